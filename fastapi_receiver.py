@@ -1,12 +1,17 @@
 # fastapi_receiver.py
-import json
 import sqlite3
 import threading
+import queue
 import os
+import logging
+from contextlib import asynccontextmanager
 from typing import Optional
+import orjson
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import paho.mqtt.client as mqtt
+from sqlite_tuning import tuned_connect
 from datetime import datetime, timezone
 
 # -------- CONFIG --------
@@ -16,22 +21,36 @@ MQTT_TOPIC = "device/telemetry"   # must match simulator topic
 
 DB_PATH = "telemetry.db"          # reuse the DB you already have
 SQLITE_TIMEOUT = 10
+WRITE_QUEUE_MAXSIZE = 10000       # rows buffered between MQTT thread and DB writer
+WRITE_BATCH = 128                 # max rows committed per transaction
+READ_POOL_SIZE = 4                # read-only connections shared by GET handlers
+DROP_LOG_EVERY = 1000             # warn on the first dropped row, then once per this many
+
 # ------------------------
 
-app = FastAPI(title="Telemetry Receiver")
+# INFO by default so the per-message debug lines are never even formatted
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger(__name__)
 
-# In-memory latest reading with lock for thread-safety
-_latest_lock = threading.Lock()
+# In-memory latest reading. Only on_message writes it, and it always swaps
+# in a new dict (never mutates the old one), so readers need no lock: a
+# module-global rebind is atomic under the GIL.
 _latest_reading: Optional[dict] = None
 
+# Rows waiting to be written by the background DB writer
+_write_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=WRITE_QUEUE_MAXSIZE)
+_writer_stop = threading.Event()
+_dropped_rows = 0
+
+# Read-only connections checked out by GET handlers. The db-writer thread
+# owns the only write connection; under WAL readers never block it.
+_read_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+
 # Ensure DB exists and WAL is enabled, and flattened table exists
 def init_db(path: str):
     need_create = not os.path.exists(path)
-    conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+    conn = tuned_connect(path, SQLITE_TIMEOUT)
     cur = conn.cursor()
-    # Enable WAL mode
-    cur.execute("PRAGMA journal_mode=WAL;")
-    conn.commit()
     # Create flattened table if doesn't exist (matches your simulator columns)
     cur.execute("""
     CREATE TABLE IF NOT EXISTS telemetry (
@@ -46,34 +65,95 @@ def init_db(path: str):
     conn.commit()
     conn.close()
 
-# Insert a single flattened row (short-lived connection to be thread safe)
-def insert_row(path: str, timestamp, battery, lat, lon, temperature):
-    conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
-    cur = conn.cursor()
-    cur.execute("""
+# Fill the read pool (call after init_db so the file and WAL mode exist)
+def open_read_pool(path: str, size: int):
+    for _ in range(size):
+        conn = tuned_connect(path, SQLITE_TIMEOUT, read_only=True)
+        # rows convert straight to dicts keyed by column name
+        conn.row_factory = sqlite3.Row
+        _read_pool.put(conn)
+
+def close_read_pool():
+    while True:
+        try:
+            conn = _read_pool.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+# Single-row INSERT reused by every batch
+INSERT_TELEMETRY_SQL = """
     INSERT INTO telemetry (timestamp, battery, lat, lon, temperature)
     VALUES (?, ?, ?, ?, ?)
-    """, (timestamp, battery, lat, lon, temperature))
-    conn.commit()
-    conn.close()
+"""
+
+# Background writer: drains the queue and commits rows in batches, so the
+# MQTT thread never waits on a connect/commit per message.
+def db_writer(path: str):
+    # isolation_level=None: no implicit BEGIN, the loop below issues exactly
+    # one BEGIN/COMMIT per batch. The INSERT stays prepared in the statement
+    # cache and is bound once per row by executemany on a reused cursor.
+    conn = tuned_connect(path, SQLITE_TIMEOUT, isolation_level=None, cached_statements=256)
+    cur = conn.cursor()
+    try:
+        # keep draining after stop is requested so queued rows are not lost
+        while not _writer_stop.is_set() or not _write_queue.empty():
+            try:
+                rows = [_write_queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(rows) < WRITE_BATCH:
+                try:
+                    rows.append(_write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                cur.execute("BEGIN")
+                cur.executemany(INSERT_TELEMETRY_SQL, rows)
+                cur.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                log.error("[DB] batch insert of %d rows failed: %s", len(rows), e)
+    finally:
+        conn.close()
+
+def start_db_writer(path: str):
+    _writer_stop.clear()
+    t = threading.Thread(target=db_writer, args=(path,), name="db-writer", daemon=True)
+    t.start()
+    return t
+
+# Queue a flattened row for the writer; drop (and count) if the writer is behind
+def enqueue_row(timestamp, battery, lat, lon, temperature):
+    global _dropped_rows
+    try:
+        _write_queue.put_nowait((timestamp, battery, lat, lon, temperature))
+    except queue.Full:
+        _dropped_rows += 1
+        # this runs on paho's network thread: don't log every drop under overload
+        if _dropped_rows % DROP_LOG_EVERY == 1:
+            log.warning("[DB] write queue full, dropped row (total dropped: %d)", _dropped_rows)
 
 # MQTT callbacks
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print("[MQTT] Connected to broker.")
+        log.info("[MQTT] Connected to broker.")
         client.subscribe(MQTT_TOPIC)
-        print(f"[MQTT] Subscribed to {MQTT_TOPIC}")
+        log.info("[MQTT] Subscribed to %s", MQTT_TOPIC)
     else:
-        print("[MQTT] Failed to connect, rc=", rc)
+        log.error("[MQTT] Failed to connect, rc=%s", rc)
 
 def on_message(client, userdata, msg):
     global _latest_reading
-    payload_text = None
+    # orjson parses the raw bytes directly (no separate utf-8 decode pass)
     try:
-        payload_text = msg.payload.decode("utf-8")
-        parsed = json.loads(payload_text)
+        parsed = orjson.loads(msg.payload)
     except Exception as e:
-        print("[MQTT] Failed to decode/parse payload:", e, "raw:", payload_text)
+        log.warning("[MQTT] Failed to decode/parse payload: %s raw: %r", e, msg.payload[:200])
         return
 
     # Extract fields
@@ -104,23 +184,20 @@ def on_message(client, userdata, msg):
     lat = to_float(lat)
     lon = to_float(lon)
 
-    # Insert into DB (short-lived connection)
-    try:
-        insert_row(DB_PATH, timestamp, battery, lat, lon, temperature)
-    except Exception as e:
-        print("[DB] insert failed:", e)
+    # Hand the row to the background DB writer
+    enqueue_row(timestamp, battery, lat, lon, temperature)
 
-    # Update in-memory latest reading (atomic)
-    with _latest_lock:
-        _latest_reading = {
-            "timestamp": timestamp,
-            "battery": battery,
-            "lat": lat,
-            "lon": lon,
-            "temperature": temperature
-        }
+    # Publish the new latest reading with a single reference swap
+    reading = {
+        "timestamp": timestamp,
+        "battery": battery,
+        "lat": lat,
+        "lon": lon,
+        "temperature": temperature
+    }
+    _latest_reading = reading
 
-    print("[MQTT] Received and stored:", _latest_reading)
+    log.debug("[MQTT] Received and queued: %s", reading)
 
 # Start MQTT client in background (non-blocking)
 def start_mqtt_background():
@@ -131,17 +208,19 @@ def start_mqtt_background():
     client.loop_start()
     return client
 
-# FastAPI lifecycle: startup/shutdown
-@app.on_event("startup")
-def startup_event():
+# FastAPI lifecycle: startup before the yield, shutdown after it
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db(DB_PATH)
+    open_read_pool(DB_PATH, READ_POOL_SIZE)
+    app.state.db_writer = start_db_writer(DB_PATH)
     try:
         app.state.mqtt_client = start_mqtt_background()
     except Exception as e:
-        print("[startup] MQTT start failed:", e)
+        log.error("[startup] MQTT start failed: %s", e)
+
+    yield
 
-@app.on_event("shutdown")
-def shutdown_event():
     client = getattr(app.state, "mqtt_client", None)
     if client:
         try:
@@ -149,6 +228,14 @@ def shutdown_event():
             client.disconnect()
         except Exception:
             pass
+    # stop the writer only after MQTT is down so no new rows arrive
+    writer = getattr(app.state, "db_writer", None)
+    if writer:
+        _writer_stop.set()
+        writer.join(timeout=5)
+    close_read_pool()
+
+app = FastAPI(title="Telemetry Receiver", lifespan=lifespan)
 
 # Response model
 class TelemetryOut(BaseModel):
@@ -158,31 +245,30 @@ class TelemetryOut(BaseModel):
     lon: Optional[float]
     temperature: Optional[float]
 
+# Read the last stored row (blocking; runs on a threadpool worker)
+def fetch_latest_row() -> Optional[dict]:
+    conn = _read_pool.get()
+    try:
+        row = conn.execute("SELECT timestamp, battery, lat, lon, temperature FROM telemetry WHERE id = (SELECT MAX(id) FROM telemetry)").fetchone()
+    finally:
+        _read_pool.put(conn)
+    return dict(row) if row else None
+
+# async so the in-memory path is served on the event loop without a
+# threadpool hop; only the SQLite fallback is pushed to a worker thread
 @app.get("/telemetry/latest", response_model=TelemetryOut)
-def get_latest():
-    # 1) try in-memory latest
-    with _latest_lock:
-        if _latest_reading is not None:
-            # return a shallow copy
-            return dict(_latest_reading)
+async def get_latest():
+    # 1) try in-memory latest (snapshot is never mutated after publish)
+    snapshot = _latest_reading
+    if snapshot is not None:
+        return snapshot
 
     # 2) fallback: query DB last row
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=SQLITE_TIMEOUT)
-        cur = conn.cursor()
-        cur.execute("SELECT timestamp, battery, lat, lon, temperature FROM telemetry ORDER BY id DESC LIMIT 1")
-        row = cur.fetchone()
-        conn.close()
+        row = await run_in_threadpool(fetch_latest_row)
         if row:
-            ts, bat, lat, lon, temp = row
-            return {
-                "timestamp": ts,
-                "battery": bat,
-                "lat": lat,
-                "lon": lon,
-                "temperature": temp
-            }
+            return row
     except Exception as e:
-        print("[GET] DB fetch failed:", e)
+        log.error("[GET] DB fetch failed: %s", e)
 
     raise HTTPException(status_code=404, detail="No telemetry available yet.")
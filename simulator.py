@@ -1,11 +1,13 @@
 # simulator.py
 import time
-import json
+import orjson
 import random
 import csv
 import os
-import sqlite3
+import logging
 import paho.mqtt.client as mqtt
+from sqlite_tuning import tuned_connect
+from datetime import datetime, timezone
 
 # ---------- CONFIG ----------
 MQTT_BROKER = "localhost"
@@ -17,11 +19,17 @@ CSV_PATH = "telemetry_log.csv"         # stored in current folder
 SEND_INTERVAL_SEC = 1                  # 1 Hz
 TOTAL_MESSAGES = 80                    # change to 60-100 as you want
 KEEP_LAST_N = 100                      # keep last 100 rows in sqlite
+WRITE_BATCH = 10                       # rows buffered before one DB transaction + CSV flush
+TRIM_EVERY = 50                        # trim the table once per this many inserts
+LOG_RATE_EVERY = 20                    # log a publish-rate summary every N messages
 DEVICE_ID = "sim-001"
+SQLITE_TIMEOUT = 10
 # -------------------------------
 
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("simulator")
+
 def get_iso_timestamp():
-    from datetime import datetime, timezone
     return datetime.now(timezone.utc).isoformat()
 
 def generate_telemetry(prev_battery=None):
@@ -45,7 +53,7 @@ def generate_telemetry(prev_battery=None):
     return payload, battery
 
 def init_sqlite(path):
-    conn = sqlite3.connect(path, timeout=10)
+    conn = tuned_connect(path, SQLITE_TIMEOUT)
     cur = conn.cursor()
     cur.execute("""
     CREATE TABLE IF NOT EXISTS telemetry (
@@ -60,6 +68,28 @@ def init_sqlite(path):
     conn.commit()
     return conn
 
+INSERT_SQL = """
+    INSERT INTO telemetry (timestamp, battery, lat, lon, temperature)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+# Write buffered rows: one transaction for SQLite, one flush for the CSV.
+# Callers hand over lists they no longer hold as pending, so an interrupt
+# part-way through can't get the same batch written twice.
+def flush_pending(conn, csv_file, csv_writer, pending_rows, pending_csv):
+    if not pending_rows:
+        return
+    with conn:
+        conn.executemany(INSERT_SQL, pending_rows)
+    csv_writer.writerows(pending_csv)
+    csv_file.flush()
+
+# Drop everything older than the newest KEEP_LAST_N ids (rowid range delete,
+# no NOT IN subquery over the whole table)
+def trim_db(conn):
+    conn.execute("DELETE FROM telemetry WHERE id <= (SELECT MAX(id) FROM telemetry) - ?", (KEEP_LAST_N,))
+    conn.commit()
+
 def init_csv(path):
     need_header = not os.path.exists(path)
     f = open(path, mode="a", newline="", encoding="utf-8")
@@ -72,7 +102,6 @@ def init_csv(path):
 def main():
     # Init DB + CSV
     conn = init_sqlite(DB_PATH)
-    cur = conn.cursor()
     csv_file, csv_writer = init_csv(CSV_PATH)
 
     # MQTT client
@@ -80,50 +109,70 @@ def main():
     try:
         client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
     except Exception as e:
-        print("MQTT connect failed:", e)
-        print("Make sure mosquitto is running and reachable at", MQTT_BROKER, MQTT_PORT)
+        log.error("MQTT connect failed: %s", e)
+        log.error("Make sure mosquitto is running and reachable at %s %s", MQTT_BROKER, MQTT_PORT)
         return
     client.loop_start()
 
     battery = None
+    sent_since_trim = 0
+    pending_rows, pending_csv = [], []
+    next_send = time.monotonic()
+    rate_i0, rate_t0 = 0, None  # rate window starts at the first publish
     try:
         for i in range(TOTAL_MESSAGES):
             payload, battery = generate_telemetry(battery)
-            payload_json = json.dumps(payload)
+            # orjson returns bytes, which paho publishes as-is
+            payload_json = orjson.dumps(payload)
 
             # Publish
             result = client.publish(MQTT_TOPIC, payload_json)
             if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                print("Publish failed rc=", result.rc)
+                log.warning("Publish failed rc=%s", result.rc)
             else:
-                print(f"Published #{i+1}: {payload_json}")
-
-            # SQLite insert
-            cur.execute("""
-                INSERT INTO telemetry (timestamp, battery, lat, lon, temperature)
-                VALUES (?, ?, ?, ?, ?)
-            """, (payload["timestamp"], payload["battery"], payload["lat"], payload["lon"], payload["temperature"]))
-            conn.commit()
-
-            # CSV append
-            csv_writer.writerow([payload["timestamp"], payload["device_id"], payload["battery"], payload["temperature"], payload["lat"], payload["lon"]])
-            csv_file.flush()
-
-            # Trim DB to KEEP_LAST_N rows
-            cur.execute("DELETE FROM telemetry WHERE id NOT IN (SELECT id FROM telemetry ORDER BY id DESC LIMIT ?)", (KEEP_LAST_N,))
-            conn.commit()
-
-            time.sleep(SEND_INTERVAL_SEC)
+                log.debug("Published #%d: %s", i + 1, payload)
+            if rate_t0 is None:
+                rate_t0 = time.monotonic()
+            elif (i + 1) % LOG_RATE_EVERY == 0:
+                # publishes since the window start, over the time between them
+                now = time.monotonic()
+                log.info("Published %d/%d messages (%.2f msg/s)", i + 1, TOTAL_MESSAGES, (i - rate_i0) / (now - rate_t0))
+                rate_i0, rate_t0 = i, now
+
+            # Buffer SQLite + CSV rows, written every WRITE_BATCH messages
+            pending_rows.append((payload["timestamp"], payload["battery"], payload["lat"], payload["lon"], payload["temperature"]))
+            pending_csv.append([payload["timestamp"], payload["device_id"], payload["battery"], payload["temperature"], payload["lat"], payload["lon"]])
+            sent_since_trim += 1
+            if len(pending_rows) >= WRITE_BATCH:
+                batch_rows, batch_csv, pending_rows, pending_csv = pending_rows, pending_csv, [], []
+                flush_pending(conn, csv_file, csv_writer, batch_rows, batch_csv)
+                # Trim DB to KEEP_LAST_N rows every TRIM_EVERY inserts
+                if sent_since_trim >= TRIM_EVERY:
+                    trim_db(conn)
+                    sent_since_trim = 0
+
+            # Sleep until the next fixed deadline so publish/DB time doesn't
+            # accumulate as drift; if we fell behind, restart from now
+            next_send += SEND_INTERVAL_SEC
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_send = time.monotonic()
 
-        print(f"Finished sending {TOTAL_MESSAGES} messages.")
+        log.info("Finished sending %d messages.", TOTAL_MESSAGES)
     except KeyboardInterrupt:
-        print("Stopped by user.")
+        log.info("Stopped by user.")
     finally:
         client.loop_stop()
         client.disconnect()
-        csv_file.close()
-        conn.close()
-        print("Closed MQTT, CSV and DB connections.")
+        try:
+            flush_pending(conn, csv_file, csv_writer, pending_rows, pending_csv)
+            trim_db(conn)
+        finally:
+            csv_file.close()
+            conn.close()
+        log.info("Closed MQTT, CSV and DB connections.")
 
 if __name__ == "__main__":
     main()
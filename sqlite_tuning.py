@@ -0,0 +1,34 @@
+# sqlite_tuning.py
+# Connection setup shared by fastapi_receiver.py and simulator.py, which
+# write to the same telemetry.db and must agree on its tuning.
+
+import sqlite3
+from pathlib import Path
+
+# Applied to every connection by tuned_connect(): only journal_mode is stored
+# in the DB file, the rest are per-connection. synchronous=NORMAL under WAL
+# skips the fsync on each commit; an OS crash or power loss can lose the last
+# committed transactions but cannot corrupt the database. Lock waits are
+# governed by the connect timeout, so no busy_timeout here.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA wal_autocheckpoint=10000;",
+    "PRAGMA mmap_size=268435456;",     # 256 MB
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-20000;",       # ~20 MB
+)
+
+# Open a connection with the tuned pragma set applied
+def tuned_connect(path: str, timeout: float, read_only: bool = False, **connect_kwargs) -> sqlite3.Connection:
+    if read_only:
+        uri = Path(path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=False, **connect_kwargs)
+    else:
+        conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, **connect_kwargs)
+    for pragma in SQLITE_PRAGMAS:
+        # journal mode is already persisted by init_db; a read-only handle can't change it
+        if read_only and pragma.startswith("PRAGMA journal_mode"):
+            continue
+        conn.execute(pragma)
+    return conn
@@ -4,7 +4,9 @@
 
 import os
 import shutil
-from fastapi import FastAPI, UploadFile, HTTPException
+import threading
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List
@@ -24,10 +26,111 @@ class InitiateResponse(BaseModel):
     chunk_size: int
 
 CHUNK_SIZE = 10 * 1024 * 1024  # 10 MB
+COPY_BUFFER_SIZE = 4 * 1024 * 1024  # fallback copy buffer when the kernel can't copy for us
+WRITE_FLUSH_SIZE = 4 * 1024 * 1024  # body bytes gathered before one off-loop disk write
+BITMAP_NAME = "uploaded.bitmap"  # one bit per chunk index, set once the chunk is on disk
+MAX_CHUNKS = 100_000  # 1 TB at CHUNK_SIZE; caps the bitmap at ~12.5 KB
+BITMAP_READ_SIZE = 64 * 1024  # status reads the bitmap in blocks of this size
+
+# Per-upload locks so concurrent chunk PUTs don't lose each other's bitmap bits
+_bitmap_locks = {}
+_bitmap_locks_guard = threading.Lock()
 
 def upload_dir(upload_id: str) -> str:
     return os.path.join(UPLOAD_ROOT, upload_id)
 
+def bitmap_lock(upload_id: str) -> threading.Lock:
+    with _bitmap_locks_guard:
+        return _bitmap_locks.setdefault(upload_id, threading.Lock())
+
+# Set (or clear) the bit for index in the upload's bitmap (read-modify-write of one byte)
+def mark_chunk_uploaded(upload_id: str, index: int, uploaded: bool = True):
+    d = upload_dir(upload_id)
+    path = os.path.join(d, BITMAP_NAME)
+    byte_idx, bit = index >> 3, 1 << (index & 7)
+    with bitmap_lock(upload_id):
+        if not os.path.exists(path):
+            # upload started before bitmaps existed: seed it from the chunk
+            # files already on disk so status doesn't hide them
+            bits = bytearray((MAX_CHUNKS + 7) // 8)
+            used = 0
+            for idx, _ in list_chunk_files(d):
+                if 0 <= idx < MAX_CHUNKS:
+                    bits[idx >> 3] |= 1 << (idx & 7)
+                    used = max(used, (idx >> 3) + 1)
+            with open(path, "wb") as f:
+                f.write(bits[:used])
+        with open(path, "r+b") as f:
+            f.seek(byte_idx)
+            cur = f.read(1)
+            f.seek(byte_idx)
+            cur = cur[0] if cur else 0
+            f.write(bytes([cur | bit if uploaded else cur & ~bit]))
+
+# Chunk indices whose bit is set, in ascending order
+def read_uploaded_chunks(bitmap_path: str) -> List[int]:
+    uploaded = []
+    base = 0
+    with open(bitmap_path, "rb") as f:
+        while True:
+            block = f.read(BITMAP_READ_SIZE)
+            if not block:
+                break
+            for byte_idx, b in enumerate(block, start=base):
+                if b:
+                    uploaded.extend(byte_idx * 8 + i for i in range(8) if b >> i & 1)
+            base += len(block)
+    return uploaded
+
+# Collapse sorted indices into inclusive [start, end] runs: [0,1,2,5] -> [[0,2],[5,5]]
+def to_ranges(indices: List[int]) -> List[List[int]]:
+    ranges = []
+    for idx in indices:
+        if ranges and idx == ranges[-1][1] + 1:
+            ranges[-1][1] = idx
+        else:
+            ranges.append([idx, idx])
+    return ranges
+
+# (index, filename) of every chunk_{index}.part in d
+def list_chunk_files(d: str):
+    chunk_files = []
+    for name in os.listdir(d):
+        if name.startswith("chunk_") and name.endswith(".part"):
+            try:
+                idx = int(name.split("_")[1].split(".")[0])
+                chunk_files.append((idx, name))
+            except Exception:
+                continue
+    return chunk_files
+
+# Remove path if it exists (leftover temp file of a failed chunk PUT)
+def discard_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Append the file at src_path to out_f. Uses copy_file_range (Linux) so the
+# bytes never pass through user space; otherwise a large-buffer copy.
+def append_file(src_path: str, out_f):
+    with open(src_path, "rb") as src_f:
+        if hasattr(os, "copy_file_range"):
+            out_f.flush()
+            remaining = os.fstat(src_f.fileno()).st_size
+            try:
+                while remaining > 0:
+                    n = os.copy_file_range(src_f.fileno(), out_f.fileno(), remaining)
+                    if n == 0:
+                        break
+                    remaining -= n
+                return
+            except OSError:
+                # e.g. cross-device on older kernels: both fds have advanced
+                # past what was copied, so the plain copy resumes from there
+                pass
+        shutil.copyfileobj(src_f, out_f, COPY_BUFFER_SIZE)
+
 @app.post("/upload/initiate", response_model=InitiateResponse)
 def initiate(req: InitiateRequest):
     """
@@ -40,49 +143,83 @@ def initiate(req: InitiateRequest):
     # store original filename for later assembly
     with open(os.path.join(d, "meta_filename.txt"), "w", encoding="utf-8") as f:
         f.write(req.filename)
+    # empty bitmap: no chunks yet
+    open(os.path.join(d, BITMAP_NAME), "wb").close()
     return InitiateResponse(upload_id=uid, chunk_size=CHUNK_SIZE)
 
 @app.get("/upload/{upload_id}/status")
 def status(upload_id: str):
     """
-    Return list of chunk indices already uploaded for this upload_id.
+    Return chunk indices already uploaded for this upload_id, as inclusive
+    [start, end] ranges so large uploads don't ship one int per chunk.
     """
     d = upload_dir(upload_id)
     if not os.path.exists(d):
         raise HTTPException(status_code=404, detail="upload_id not found")
-    # chunk files are saved as chunk_{index}.part
-    uploaded = []
-    for name in os.listdir(d):
-        if name.startswith("chunk_") and name.endswith(".part"):
-            try:
-                idx = int(name.split("_")[1].split(".")[0])
-                uploaded.append(idx)
-            except Exception:
-                continue
-    uploaded.sort()
-    return {"uploaded_chunks": uploaded}
+    bitmap_path = os.path.join(d, BITMAP_NAME)
+    if os.path.exists(bitmap_path):
+        uploaded = read_uploaded_chunks(bitmap_path)
+    else:
+        # uploads started before the bitmap existed: scan chunk files
+        uploaded = sorted(idx for idx, _ in list_chunk_files(d))
+    return {"uploaded_ranges": to_ranges(uploaded)}
 
 @app.put("/upload/{upload_id}/chunk/{index}")
-async def upload_chunk(upload_id: str, index: int, file: UploadFile):
+async def upload_chunk(upload_id: str, index: int, request: Request):
     """
     Upload a single chunk with index (0-based).
-    The request body should be the binary chunk.
+    The request body should be the raw binary chunk (application/octet-stream,
+    not multipart); it is streamed to a temp file as it arrives and only
+    replaces chunk_{index}.part once the whole body is in, so a retry that
+    drops mid-body never damages a chunk that was already stored.
     """
     d = upload_dir(upload_id)
     if not os.path.exists(d):
         raise HTTPException(status_code=404, detail="upload_id not found")
+    if not 0 <= index < MAX_CHUNKS:
+        raise HTTPException(status_code=400, detail=f"chunk index must be in [0, {MAX_CHUNKS})")
     # Save chunk to disk as chunk_{index}.part
     chunk_path = os.path.join(d, f"chunk_{index}.part")
-    # If chunk already exists, overwrite (idempotent)
+    tmp_path = chunk_path + ".tmp"
+    # the body isn't parsed any more, so a short body must be caught here
+    expected = request.headers.get("content-length")
+    # If chunk already exists, overwrite (idempotent). Its bit is cleared
+    # until the new body is in place, so status never vouches for a chunk
+    # that's being rewritten.
+    await run_in_threadpool(mark_chunk_uploaded, upload_id, index, False)
+    # Disk writes run on the threadpool so a slow disk never stalls the event
+    # loop (and with it every other upload); pieces are batched so that's a
+    # handful of thread hops per chunk rather than one per network read.
     try:
-        with open(chunk_path, "wb") as out_f:
-            while True:
-                chunk = await file.read(1024 * 1024)
-                if not chunk:
-                    break
-                out_f.write(chunk)
+        out_f = await run_in_threadpool(open, tmp_path, "wb")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"write error: {e}")
+    try:
+        received = 0
+        pending, pending_size = [], 0
+        async for piece in request.stream():
+            pending.append(piece)
+            pending_size += len(piece)
+            if pending_size >= WRITE_FLUSH_SIZE:
+                await run_in_threadpool(out_f.writelines, pending)
+                received += pending_size
+                pending, pending_size = [], 0
+        if pending:
+            await run_in_threadpool(out_f.writelines, pending)
+            received += pending_size
+        await run_in_threadpool(out_f.close)
+        if expected is not None and received != int(expected):
+            raise HTTPException(status_code=400, detail=f"incomplete body: got {received} of {expected} bytes")
+        await run_in_threadpool(os.replace, tmp_path, chunk_path)
+    except BaseException as e:
+        # Inline, not on the threadpool: when the client goes away the request
+        # is cancelled and can't await anything, and the temp file must still go.
+        out_f.close()
+        discard_file(tmp_path)
+        if isinstance(e, Exception) and not isinstance(e, HTTPException):
+            raise HTTPException(status_code=500, detail=f"write error: {e}")
+        raise
+    await run_in_threadpool(mark_chunk_uploaded, upload_id, index)
     return JSONResponse({"status": "ok", "index": index})
 
 @app.post("/upload/{upload_id}/complete")
@@ -96,18 +233,18 @@ def complete(upload_id: str):
         raise HTTPException(status_code=404, detail="upload_id not found")
 
     # find chunk indices
-    chunk_files = []
-    for name in os.listdir(d):
-        if name.startswith("chunk_") and name.endswith(".part"):
-            try:
-                idx = int(name.split("_")[1].split(".")[0])
-                chunk_files.append((idx, name))
-            except Exception:
-                continue
+    chunk_files = list_chunk_files(d)
     if not chunk_files:
         raise HTTPException(status_code=400, detail="no chunks uploaded")
 
     chunk_files.sort(key=lambda x: x[0])
+    # assemble only what status reports: every chunk file must have its bit set
+    bitmap_path = os.path.join(d, BITMAP_NAME)
+    if os.path.exists(bitmap_path):
+        uploaded = set(read_uploaded_chunks(bitmap_path))
+        missing = [idx for idx, _ in chunk_files if idx not in uploaded]
+        if missing or len(uploaded) != len(chunk_files):
+            raise HTTPException(status_code=409, detail=f"chunks not fully uploaded: {to_ranges(missing)}")
     # read filename from meta
     with open(os.path.join(d, "meta_filename.txt"), "r", encoding="utf-8") as f:
         original_name = f.read().strip() or "assembled.bin"
@@ -116,9 +253,7 @@ def complete(upload_id: str):
     try:
         with open(final_path, "wb") as out_f:
             for idx, fname in chunk_files:
-                part_path = os.path.join(d, fname)
-                with open(part_path, "rb") as pf:
-                    shutil.copyfileobj(pf, out_f)
+                append_file(os.path.join(d, fname), out_f)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"assemble error: {e}")
 
@@ -127,5 +262,7 @@ def complete(upload_id: str):
         shutil.rmtree(d)
     except Exception:
         pass
+    with _bitmap_locks_guard:
+        _bitmap_locks.pop(upload_id, None)
 
     return {"status": "assembled", "final_path": final_path}
@@ -7,23 +7,34 @@ import sys
 import time
 import json
 import hashlib
+import mmap
 import argparse
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 DEFAULT_SERVER = "http://localhost:9000"
 CHUNK_SIZE = 10 * 1024 * 1024  # 10 MB
 PROGRESS_META_EXT = ".uploadmeta.json"
 RETRY_BACKOFF = [1, 2, 5, 10]  # seconds
+UPLOAD_WORKERS = 4  # chunk PUTs in flight at once
+HASH_BUFFER_SIZE = 1024 * 1024  # 1 MiB reads keep the hash loop in C, not Python
 
 def md5_of_file(path):
-    h = hashlib.md5()
-    with open(path, "rb") as f:
+    with open(path, "rb", buffering=0) as f:
+        # Python 3.11+: the read/update loop runs entirely in C
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "md5").hexdigest()
+        h = hashlib.md5()
+        # reuse one buffer for every read instead of allocating a new bytes object per chunk
+        buf = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buf)
         while True:
-            chunk = f.read(8192)
-            if not chunk:
+            n = f.readinto(buf)
+            if not n:
                 break
-            h.update(chunk)
+            h.update(view[:n])
     return h.hexdigest()
 
 def load_meta(meta_path):
@@ -46,15 +57,27 @@ def get_uploaded_chunks(server, upload_id):
     url = server.rstrip("/") + f"/upload/{upload_id}/status"
     resp = requests.get(url)
     if resp.status_code == 404:
-        return []
+        return set()
     resp.raise_for_status()
-    return resp.json().get("uploaded_chunks", [])
-
-def upload_chunk(server, upload_id, index, data):
+    data = resp.json()
+    if "uploaded_ranges" in data:
+        # inclusive [start, end] runs
+        return {i for start, end in data["uploaded_ranges"] for i in range(start, end + 1)}
+    # older servers send the flat index list
+    return set(data.get("uploaded_chunks", []))
+
+# Session shared by the upload workers; pool sized so each worker keeps its own keep-alive connection
+def make_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def upload_chunk(session, server, upload_id, index, data):
     url = server.rstrip("/") + f"/upload/{upload_id}/chunk/{index}"
-    files = {"file": ("chunk", data)}
-    # use streaming to avoid loading whole chunk into memory again
-    resp = requests.put(url, files=files, timeout=60)
+    # raw body, no multipart framing: the mmap slice goes to the socket without a copy
+    resp = session.put(url, data=data, headers={"Content-Type": "application/octet-stream"}, timeout=60)
     resp.raise_for_status()
     return resp.json()
 
@@ -64,16 +87,56 @@ def complete_upload(server, upload_id):
     resp.raise_for_status()
     return resp.json()
 
-def run_upload(file_path, server):
-    file_size = os.path.getsize(file_path)
+# Upload one chunk with retries; runs on a worker thread. file_view is a
+# memoryview over the mmapped file: slicing it is zero-copy and needs no
+# seek, so workers never share a file position.
+def upload_chunk_with_retries(session, server, upload_id, file_view, idx, chunk_size):
+    with file_view[idx * chunk_size:(idx + 1) * chunk_size] as chunk_data:
+        for attempt, backoff in enumerate(RETRY_BACKOFF, start=1):
+            try:
+                upload_chunk(session, server, upload_id, idx, chunk_data)
+                return True
+            except requests.exceptions.RequestException as e:
+                print(f"Chunk {idx} upload attempt {attempt} failed: {e}. Retrying in {backoff}s")
+                time.sleep(backoff)
+    return False
+
+# Upload the pending chunk indices concurrently. Returns the index that
+# failed after all retries, or None when every chunk went through.
+def upload_pending(session, server, upload_id, file_view, pending, chunk_size, workers, uploaded, pbar):
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = {
+            ex.submit(upload_chunk_with_retries, session, server, upload_id, file_view, idx, chunk_size): idx
+            for idx in pending
+        }
+        for fut in as_completed(futures):
+            idx = futures[fut]
+            if fut.result():
+                uploaded.add(idx)
+                pbar.update(1)
+            else:
+                # drop queued chunks, let in-flight ones finish
+                for other in futures:
+                    other.cancel()
+                return idx
+    return None
+
+def run_upload(file_path, server, workers=UPLOAD_WORKERS):
+    st = os.stat(file_path)
+    file_size = st.st_size
     filename = os.path.basename(file_path)
     meta_path = file_path + PROGRESS_META_EXT
 
-    # Compute file checksum to detect file changes (optional but safe)
-    file_md5 = md5_of_file(file_path)
-
     # Load meta or initiate new
     meta = load_meta(meta_path)
+
+    # Compute file checksum to detect file changes (optional but safe).
+    # Same size + mtime as recorded in meta: reuse the stored digest instead of re-reading the file.
+    if meta and meta.get("file_md5") and meta.get("file_size") == file_size and meta.get("mtime_ns") == st.st_mtime_ns:
+        file_md5 = meta["file_md5"]
+    else:
+        file_md5 = md5_of_file(file_path)
+
     if meta and meta.get("file_md5") != file_md5:
         print("File changed since previous upload meta. Removing old meta and starting new.")
         meta = None
@@ -91,20 +154,25 @@ def run_upload(file_path, server):
             "chunk_size": chunk_size,
             "file_size": file_size,
             "filename": filename,
-            "file_md5": file_md5
+            "file_md5": file_md5,
+            "mtime_ns": st.st_mtime_ns
         }
         save_meta(meta_path, meta)
         print("Initiated upload:", upload_id)
     else:
         upload_id = meta["upload_id"]
         chunk_size = meta["chunk_size"]
+        # content unchanged but mtime new (or older meta): record it so the next resume skips hashing
+        if meta.get("mtime_ns") != st.st_mtime_ns:
+            meta["mtime_ns"] = st.st_mtime_ns
+            save_meta(meta_path, meta)
         print("Resuming upload:", upload_id)
 
     total_chunks = (file_size + chunk_size - 1) // chunk_size
 
     # Ask server for already uploaded chunks
     try:
-        uploaded = set(get_uploaded_chunks(server, upload_id))
+        uploaded = get_uploaded_chunks(server, upload_id)
     except Exception as e:
         print("Could not query server status:", e)
         uploaded = set()
@@ -113,33 +181,24 @@ def run_upload(file_path, server):
     done_chunks = len(uploaded)
     pbar = tqdm(total=total_chunks, desc="Chunks", initial=done_chunks, unit="chunk")
 
-    with open(file_path, "rb") as f:
-        for idx in range(total_chunks):
-            if idx in uploaded:
-                # skip reading this chunk (but must advance file handle)
-                f.seek(chunk_size, 1)
-                continue
-
-            # read chunk bytes
-            chunk_data = f.read(chunk_size)
-            # attempt upload with retries
-            for attempt, backoff in enumerate(RETRY_BACKOFF, start=1):
-                try:
-                    # NOTE: requests will stream the bytes in memory - acceptable for chunk sized uploads
-                    upload_chunk(server, upload_id, idx, chunk_data)
-                    # mark chunk as uploaded in server-side; update local meta optionally by re-querying status
-                    uploaded.add(idx)
-                    save_meta(meta_path, meta)  # persist meta (upload id etc)
-                    pbar.update(1)
-                    break
-                except requests.exceptions.RequestException as e:
-                    print(f"Chunk {idx} upload attempt {attempt} failed: {e}. Retrying in {backoff}s")
-                    time.sleep(backoff)
-            else:
-                # all retries failed for this chunk
-                print(f"Chunk {idx} failed after retries, exiting for resume later.")
-                pbar.close()
-                return False
+    # Upload missing chunks concurrently. Progress lives on the server (status
+    # endpoint), so the meta file saved at initiate needs no per-chunk rewrite.
+    pending = [idx for idx in range(total_chunks) if idx not in uploaded]
+    failed_idx = None
+    if pending:  # (an empty file can't be mmapped, and has nothing to send)
+        session = make_session(workers)
+        # map the file once; chunks are served straight from the page cache
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            file_view = memoryview(mm)
+            try:
+                failed_idx = upload_pending(session, server, upload_id, file_view, pending, chunk_size, workers, uploaded, pbar)
+            finally:
+                file_view.release()
+        session.close()
+    if failed_idx is not None:
+        print(f"Chunk {failed_idx} failed after retries, exiting for resume later.")
+        pbar.close()
+        return False
 
     pbar.close()
     # All chunks uploaded. Call complete
@@ -160,8 +219,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Chunked uploader with resume")
     parser.add_argument("file", help="Path to file to upload")
     parser.add_argument("--server", default=DEFAULT_SERVER, help="Upload server base URL")
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS, help="Concurrent chunk uploads")
     args = parser.parse_args()
-    ok = run_upload(args.file, args.server)
+    ok = run_upload(args.file, args.server, args.workers)
     if ok:
         print("Upload succeeded.")
     else: